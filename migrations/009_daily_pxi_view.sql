@@ -0,0 +1,35 @@
+-- Migration 009: Daily PXI Materialized View
+-- Precompute the last PXI value per day for LSTM training (ml/lstm_predictor.py)
+
+-- Last composite PXI value of each day
+CREATE MATERIALIZED VIEW IF NOT EXISTS daily_pxi AS
+SELECT DISTINCT ON (timestamp::date)
+  timestamp::date AS day,
+  pxi_value
+FROM composite_pxi_regime
+ORDER BY timestamp::date, timestamp DESC;
+
+-- Unique index (range scans by day, required for CONCURRENTLY refresh)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_daily_pxi_day
+  ON daily_pxi(day);
+
+-- Grant access to materialized view
+GRANT SELECT ON daily_pxi TO pxi;
+
+-- Refresh function (run daily at 02:45 UTC by scheduler.ts; not refreshed on write)
+-- SECURITY DEFINER so pxi can refresh even when it does not own the view
+CREATE OR REPLACE FUNCTION refresh_daily_pxi()
+RETURNS void AS $$
+BEGIN
+  REFRESH MATERIALIZED VIEW CONCURRENTLY daily_pxi;
+END;
+$$ LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public;
+
+GRANT EXECUTE ON FUNCTION refresh_daily_pxi() TO pxi;
+
+-- Comments
+COMMENT ON MATERIALIZED VIEW daily_pxi IS 'Last composite PXI value per day (refreshed daily at 02:45 UTC by scheduler.ts)';
+COMMENT ON COLUMN daily_pxi.day IS 'Calendar day of the composite_pxi_regime timestamp';
+COMMENT ON COLUMN daily_pxi.pxi_value IS 'Latest PXI value recorded on that day';
@@ -8,21 +8,22 @@ Trains on historical PXI time series and generates multi-day forecasts.
 Usage:
     python3 ml/lstm_predictor.py --horizon=7 --days=365 --retrain
     python3 ml/lstm_predictor.py --horizon=14 --load-model
+    python3 ml/lstm_predictor.py --horizon=7 --quantize
 """
 
 import argparse
 import json
 import sys
 import os
+from collections import Counter
 from datetime import datetime
 from typing import List, Dict, Tuple
 
 import numpy as np
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset, DataLoader
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.pool
 
 
 # ============================================================================
@@ -46,43 +47,59 @@ class Config:
     # Training
     BATCH_SIZE = 16
     EPOCHS = 100
+    PATIENCE = 15         # Epochs without val improvement before stopping
     LEARNING_RATE = 0.001
     TRAIN_SPLIT = 0.8     # 80% train, 20% validation
 
     # Paths
     MODEL_DIR = 'ml/models'
     MODEL_PATH = 'ml/models/lstm_pxi_predictor.pt'
-    SCALER_PATH = 'ml/models/scaler_params.json'
 
     # Device
     DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
+    # Database connection pool (created lazily by get_connection_pool)
+    _pool = None
+
 
 # ============================================================================
 # Data Management
 # ============================================================================
 
+def get_connection_pool() -> psycopg2.pool.SimpleConnectionPool:
+    """Return the shared connection pool, creating it on first use"""
+    if Config._pool is None:
+        Config._pool = psycopg2.pool.SimpleConnectionPool(1, 4, Config.DB_URL)
+    return Config._pool
+
+
 def fetch_historical_pxi(days: int = 365) -> np.ndarray:
     """Fetch historical PXI values from database"""
     try:
-        conn = psycopg2.connect(Config.DB_URL)
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-        query = """
-            SELECT DISTINCT ON (DATE(timestamp))
-                pxi_value
-            FROM composite_pxi_regime
-            WHERE timestamp >= NOW() - INTERVAL '%s days'
-            ORDER BY DATE(timestamp) ASC, timestamp DESC
-        """
-
-        cursor.execute(query, (days,))
-        rows = cursor.fetchall()
-
-        pxi_values = np.array([float(row['pxi_value']) for row in rows])
-
-        cursor.close()
-        conn.close()
+        pool = get_connection_pool()
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                # daily_pxi (migration 009, refreshed daily by scheduler.ts)
+                # holds the last value per day, so this is an index range scan
+                # instead of a DISTINCT ON sort
+                query = """
+                    SELECT pxi_value::float8
+                    FROM daily_pxi
+                    WHERE day >= CURRENT_DATE - %s::int
+                    ORDER BY day ASC
+                """
+
+                cursor.execute(query, (days,))
+
+                # Plain tuple cursor: float8 arrives as Python floats, no dicts
+                pxi_values = np.fromiter(
+                    (row[0] for row in cursor),
+                    dtype=np.float64,
+                    count=cursor.rowcount
+                )
+        finally:
+            pool.putconn(conn)
 
         print(f"Fetched {len(pxi_values)} PXI data points", file=sys.stderr)
         return pxi_values
@@ -98,58 +115,58 @@ class MinMaxScaler:
         self.min = None
         self.max = None
 
+    def set_params(self, data_min: float, data_max: float):
+        """Set min/max and precompute the affine transform coefficients"""
+        self.min = data_min
+        self.max = data_max
+
+        # transform: x * scale + bias; inverse_transform: y * inv_scale + inv_bias
+        data_range = data_max - data_min + 1e-8
+        self._scale = 2.0 / data_range
+        self._bias = -1.0 - data_min * self._scale
+        self._inv_scale = data_range / 2.0
+        self._inv_bias = data_min + self._inv_scale
+
     def fit(self, data: np.ndarray):
         """Fit scaler to data"""
-        self.min = data.min()
-        self.max = data.max()
+        self.set_params(data.min(), data.max())
 
     def transform(self, data: np.ndarray) -> np.ndarray:
         """Transform data to [-1, 1] range"""
-        return 2 * (data - self.min) / (self.max - self.min + 1e-8) - 1
+        out = np.multiply(data, self._scale)
+        out += self._bias
+        return out
 
     def inverse_transform(self, data: np.ndarray) -> np.ndarray:
         """Inverse transform from [-1, 1] to original range"""
-        return (data + 1) * (self.max - self.min + 1e-8) / 2 + self.min
-
-    def save(self, path: str):
-        """Save scaler parameters"""
-        params = {'min': float(self.min), 'max': float(self.max)}
-        with open(path, 'w') as f:
-            json.dump(params, f)
-
-    def load(self, path: str):
-        """Load scaler parameters"""
-        with open(path, 'r') as f:
-            params = json.load(f)
-        self.min = params['min']
-        self.max = params['max']
-
-
-class PXIDataset(Dataset):
-    """PyTorch dataset for PXI time series"""
-    def __init__(self, sequences: np.ndarray, targets: np.ndarray):
-        self.sequences = torch.FloatTensor(sequences)
-        self.targets = torch.FloatTensor(targets)
-
-    def __len__(self):
-        return len(self.sequences)
-
-    def __getitem__(self, idx):
-        return self.sequences[idx], self.targets[idx]
+        out = np.multiply(data, self._inv_scale)
+        out += self._inv_bias
+        return out
+
+
+def to_device_tensors(
+    sequences: np.ndarray,
+    targets: np.ndarray
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Upload sequences (N, L, 1) and targets (N, 1) to the device as float32"""
+    # The dataset is small enough to live on the device for the whole run,
+    # so batches are sliced from these tensors instead of copied per step
+    sequences = np.ascontiguousarray(sequences, dtype=np.float32)[..., None]
+    targets = np.ascontiguousarray(targets, dtype=np.float32)[:, None]
+    return (
+        torch.from_numpy(sequences).to(Config.DEVICE),
+        torch.from_numpy(targets).to(Config.DEVICE)
+    )
 
 
 def create_sequences(data: np.ndarray, seq_length: int) -> Tuple[np.ndarray, np.ndarray]:
     """Create sequences for LSTM training"""
-    sequences = []
-    targets = []
+    # Sliding window view over the series (no Python loop, no per-step copies);
+    # the final window has no next-day target, so drop it
+    sequences = np.lib.stride_tricks.sliding_window_view(data, seq_length)[:-1]
+    targets = data[seq_length:]
 
-    for i in range(len(data) - seq_length):
-        seq = data[i:i + seq_length]
-        target = data[i + seq_length]
-        sequences.append(seq)
-        targets.append(target)
-
-    return np.array(sequences), np.array(targets)
+    return np.ascontiguousarray(sequences), targets
 
 
 # ============================================================================
@@ -176,6 +193,10 @@ class LSTMPredictor(nn.Module):
         # Fully connected output layer
         self.fc = nn.Linear(hidden_size, 1)
 
+        # Scaler params travel with the weights so the checkpoint is self-describing
+        self.register_buffer('scaler_min', torch.zeros(1, dtype=torch.float64))
+        self.register_buffer('scaler_max', torch.ones(1, dtype=torch.float64))
+
     def forward(self, x):
         # x shape: (batch, seq_length, input_size)
         lstm_out, _ = self.lstm(x)
@@ -195,60 +216,91 @@ class LSTMPredictor(nn.Module):
 
 def train_model(
     model: nn.Module,
-    train_loader: DataLoader,
-    val_loader: DataLoader,
+    train_data: Tuple[torch.Tensor, torch.Tensor],
+    val_data: Tuple[torch.Tensor, torch.Tensor],
     epochs: int = 100,
-    learning_rate: float = 0.001
+    learning_rate: float = 0.001,
+    batch_size: int = 16,
+    patience: int = 15
 ) -> Dict[str, List[float]]:
     """Train LSTM model"""
     criterion = nn.MSELoss()
     optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
 
+    # bf16 autocast on GPU; same exponent range as fp32, so no GradScaler needed
+    use_amp = Config.DEVICE.type == 'cuda'
+
+    X_train, y_train = train_data
+    X_val, y_val = val_data
+    n_train = len(X_train)
+    n_val = len(X_val)
+
     history = {'train_loss': [], 'val_loss': []}
     best_val_loss = float('inf')
+    best_state = None
+    epochs_since_best = 0
 
     print(f"\nTraining on {Config.DEVICE}...", file=sys.stderr)
 
     for epoch in range(epochs):
         # Training phase
         model.train()
-        train_losses = []
+        # Accumulate on-device; a single .item() sync per epoch
+        train_loss_sum = torch.zeros((), device=Config.DEVICE)
+        n_batches = 0
+
+        idx = torch.randperm(n_train, device=X_train.device)
 
-        for sequences, targets in train_loader:
-            sequences = sequences.unsqueeze(-1).to(Config.DEVICE)
-            targets = targets.unsqueeze(-1).to(Config.DEVICE)
+        for i in range(0, n_train, batch_size):
+            batch_idx = idx[i:i + batch_size]
+            sequences = X_train[batch_idx]
+            targets = y_train[batch_idx]
 
-            optimizer.zero_grad()
-            outputs = model(sequences)
-            loss = criterion(outputs, targets)
+            optimizer.zero_grad(set_to_none=True)
+
+            with torch.autocast(
+                device_type=Config.DEVICE.type,
+                dtype=torch.bfloat16,
+                enabled=use_amp
+            ):
+                outputs = model(sequences)
+                loss = criterion(outputs, targets)
             loss.backward()
             optimizer.step()
 
-            train_losses.append(loss.item())
+            train_loss_sum += loss.detach()
+            n_batches += 1
 
-        avg_train_loss = np.mean(train_losses)
+        avg_train_loss = (train_loss_sum / n_batches).item()
         history['train_loss'].append(avg_train_loss)
 
         # Validation phase
         model.eval()
-        val_losses = []
+        val_loss_sum = torch.zeros((), device=Config.DEVICE)
+        n_batches = 0
 
-        with torch.no_grad():
-            for sequences, targets in val_loader:
-                sequences = sequences.unsqueeze(-1).to(Config.DEVICE)
-                targets = targets.unsqueeze(-1).to(Config.DEVICE)
+        with torch.inference_mode():
+            for i in range(0, n_val, batch_size):
+                sequences = X_val[i:i + batch_size]
+                targets = y_val[i:i + batch_size]
 
                 outputs = model(sequences)
                 loss = criterion(outputs, targets)
-                val_losses.append(loss.item())
+                val_loss_sum += loss
+                n_batches += 1
 
-        avg_val_loss = np.mean(val_losses)
+        avg_val_loss = (val_loss_sum / n_batches).item()
         history['val_loss'].append(avg_val_loss)
 
-        # Save best model
+        # Track best model in memory; written to disk once after training
         if avg_val_loss < best_val_loss:
             best_val_loss = avg_val_loss
-            torch.save(model.state_dict(), Config.MODEL_PATH)
+            best_state = {
+                k: v.detach().clone() for k, v in model.state_dict().items()
+            }
+            epochs_since_best = 0
+        else:
+            epochs_since_best += 1
 
         # Log progress every 10 epochs
         if (epoch + 1) % 10 == 0:
@@ -259,6 +311,19 @@ def train_model(
                 file=sys.stderr
             )
 
+        if epochs_since_best >= patience:
+            print(
+                f"Early stopping at epoch {epoch + 1}/{epochs} "
+                f"(no improvement for {patience} epochs)",
+                file=sys.stderr
+            )
+            break
+
+    # Restore and save best model
+    if best_state is not None:
+        model.load_state_dict(best_state)
+        torch.save(best_state, Config.MODEL_PATH, _use_new_zipfile_serialization=True)
+
     print(f"\nBest validation loss: {best_val_loss:.6f}", file=sys.stderr)
     return history
 
@@ -267,18 +332,24 @@ def train_model(
 # Prediction
 # ============================================================================
 
-def derive_regime(pxi: float) -> str:
-    """Map PXI value to regime category"""
-    if pxi > 2.0:
-        return 'Strong PAMP'
-    elif pxi > 1.0:
-        return 'Moderate PAMP'
-    elif pxi >= -1.0:
-        return 'Normal'
-    elif pxi >= -2.0:
-        return 'Elevated Stress'
-    else:
-        return 'Crisis'
+# Regime bands:
+#   Crisis < -2 <= Elevated Stress < -1 <= Normal <= 1 < Moderate PAMP <= 2 < Strong PAMP
+_STRESS_THRESHOLDS = np.array([-2.0, -1.0])  # lower bound inclusive
+_PAMP_THRESHOLDS = np.array([1.0, 2.0])      # upper bound inclusive
+_REGIME_LABELS = np.array(
+    ['Crisis', 'Elevated Stress', 'Normal', 'Moderate PAMP', 'Strong PAMP']
+)
+
+
+def derive_regimes(pxi: np.ndarray) -> np.ndarray:
+    """Map an array of PXI values to regime categories"""
+    # side='right' counts thresholds <= pxi, side='left' counts thresholds < pxi,
+    # matching the inclusive edges on each side of Normal
+    idx = (
+        np.searchsorted(_STRESS_THRESHOLDS, pxi, side='right')
+        + np.searchsorted(_PAMP_THRESHOLDS, pxi, side='left')
+    )
+    return _REGIME_LABELS[idx]
 
 
 def predict_future(
@@ -290,37 +361,41 @@ def predict_future(
     """Generate multi-day forecast"""
     model.eval()
 
-    # Prepare initial sequence
-    current_seq = scaler.transform(initial_sequence.copy())
-    forecasts = []
+    # Prepare initial window (batch_size=1, seq_length, features=1)
+    window = scaler.transform(initial_sequence[-Config.SEQUENCE_LENGTH:])
+    input_seq = torch.from_numpy(np.ascontiguousarray(window, dtype=np.float32))
+    input_seq = input_seq.view(1, -1, 1).to(Config.DEVICE)
 
-    with torch.no_grad():
-        for day in range(1, horizon + 1):
-            # Prepare input (batch_size=1, seq_length, features=1)
-            input_seq = torch.FloatTensor(current_seq[-Config.SEQUENCE_LENGTH:])
-            input_seq = input_seq.unsqueeze(0).unsqueeze(-1).to(Config.DEVICE)
+    predictions = torch.empty(horizon, device=Config.DEVICE)
 
-            # Predict next value
-            pred_scaled = model(input_seq).item()
+    with torch.inference_mode():
+        # Encode the window once, then carry (h, c) forward and feed only the
+        # newest prediction each day instead of re-encoding the whole window
+        lstm_out, (h, c) = model.lstm(input_seq)
+        pred = model.fc(lstm_out[:, -1, :])
+        predictions[0] = pred.squeeze()
 
-            # Inverse transform to get actual PXI
-            pred_pxi = scaler.inverse_transform(np.array([pred_scaled]))[0]
+        for day in range(1, horizon):
+            lstm_out, (h, c) = model.lstm(pred.unsqueeze(-1), (h, c))
+            pred = model.fc(lstm_out[:, -1, :])
+            predictions[day] = pred.squeeze()
 
-            # Derive regime
-            regime = derive_regime(pred_pxi)
+    # Single device sync, then inverse transform to get actual PXI
+    pred_pxi = scaler.inverse_transform(predictions.cpu().numpy().astype(np.float64))
 
-            # Estimate confidence (simple heuristic: higher for shorter horizons)
-            confidence = max(0.5, 0.95 - (day - 1) * 0.05)
+    regimes = derive_regimes(pred_pxi).tolist()
 
-            forecasts.append({
-                'day': day,
-                'predictedPxi': float(pred_pxi),
-                'predictedRegime': regime,
-                'confidence': confidence
-            })
+    forecasts = []
+    for day in range(1, horizon + 1):
+        # Estimate confidence (simple heuristic: higher for shorter horizons)
+        confidence = max(0.5, 0.95 - (day - 1) * 0.05)
 
-            # Update sequence with prediction for next iteration
-            current_seq = np.append(current_seq, pred_scaled)
+        forecasts.append({
+            'day': day,
+            'predictedPxi': float(pred_pxi[day - 1]),
+            'predictedRegime': regimes[day - 1],
+            'confidence': confidence
+        })
 
     return forecasts
 
@@ -335,8 +410,17 @@ def main():
     parser.add_argument('--days', type=int, default=365, help='Historical days for training')
     parser.add_argument('--retrain', action='store_true', help='Retrain model from scratch')
     parser.add_argument('--epochs', type=int, default=100, help='Training epochs')
+    parser.add_argument(
+        '--quantize',
+        action='store_true',
+        help='Run forecast with an int8 dynamically quantized model (CPU only)'
+    )
     args = parser.parse_args()
 
+    if args.horizon < 1:
+        print(f"Error: Horizon must be at least 1 day (got {args.horizon})", file=sys.stderr)
+        sys.exit(1)
+
     # Ensure model directory exists
     os.makedirs(Config.MODEL_DIR, exist_ok=True)
 
@@ -354,6 +438,13 @@ def main():
     # Check if we need to train
     need_training = args.retrain or not os.path.exists(Config.MODEL_PATH)
 
+    # int8 dynamic quantization only applies to forecast-only runs on CPU
+    quantize = args.quantize and Config.DEVICE.type == 'cpu' and not need_training
+    if args.quantize and need_training:
+        print("Skipping --quantize: only applies when loading an existing model", file=sys.stderr)
+    elif args.quantize and not quantize:
+        print("Skipping --quantize: int8 dynamic quantization is CPU only", file=sys.stderr)
+
     if need_training:
         print("Training new model...", file=sys.stderr)
 
@@ -364,11 +455,8 @@ def main():
         # Train/val split
         split_idx = int(len(sequences) * Config.TRAIN_SPLIT)
 
-        train_dataset = PXIDataset(sequences[:split_idx], targets[:split_idx])
-        val_dataset = PXIDataset(sequences[split_idx:], targets[split_idx:])
-
-        train_loader = DataLoader(train_dataset, batch_size=Config.BATCH_SIZE, shuffle=True)
-        val_loader = DataLoader(val_dataset, batch_size=Config.BATCH_SIZE, shuffle=False)
+        train_data = to_device_tensors(sequences[:split_idx], targets[:split_idx])
+        val_data = to_device_tensors(sequences[split_idx:], targets[split_idx:])
 
         # Initialize model
         model = LSTMPredictor(
@@ -378,11 +466,19 @@ def main():
             dropout=Config.DROPOUT
         ).to(Config.DEVICE)
 
-        # Train
-        history = train_model(model, train_loader, val_loader, epochs=args.epochs)
+        # Store scaler params in the model so they are saved with the checkpoint
+        model.scaler_min.fill_(float(scaler.min))
+        model.scaler_max.fill_(float(scaler.max))
 
-        # Save scaler
-        scaler.save(Config.SCALER_PATH)
+        # Train
+        history = train_model(
+            model,
+            train_data,
+            val_data,
+            epochs=args.epochs,
+            batch_size=Config.BATCH_SIZE,
+            patience=Config.PATIENCE
+        )
 
         print(f"Model saved to {Config.MODEL_PATH}", file=sys.stderr)
     else:
@@ -396,10 +492,32 @@ def main():
             dropout=Config.DROPOUT
         ).to(Config.DEVICE)
 
-        model.load_state_dict(torch.load(Config.MODEL_PATH, map_location=Config.DEVICE))
+        # Memory-map weights straight from the zipfile checkpoint
+        state = torch.load(
+            Config.MODEL_PATH,
+            map_location=Config.DEVICE,
+            mmap=True,
+            weights_only=True
+        )
 
-        # Load scaler
-        scaler.load(Config.SCALER_PATH)
+        if 'scaler_min' not in state:
+            print(
+                "Error: checkpoint has no scaler params (saved by an older version); "
+                "rerun with --retrain",
+                file=sys.stderr
+            )
+            sys.exit(1)
+
+        model.load_state_dict(state)
+
+        # Quantize in memory only; the fp32 checkpoint stays the single artifact
+        if quantize:
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {nn.LSTM, nn.Linear}, dtype=torch.qint8
+            )
+
+        # Restore scaler params saved with the model
+        scaler.set_params(model.scaler_min.item(), model.scaler_max.item())
 
     # Generate forecasts
     print(f"Generating {args.horizon}-day forecast...", file=sys.stderr)
@@ -407,6 +525,13 @@ def main():
     initial_sequence = historical_pxi[-Config.SEQUENCE_LENGTH:]
     forecasts = predict_future(model, scaler, initial_sequence, args.horizon)
 
+    pxi_arr = np.fromiter(
+        (f['predictedPxi'] for f in forecasts), dtype=np.float64, count=len(forecasts)
+    )
+    conf_arr = np.fromiter(
+        (f['confidence'] for f in forecasts), dtype=np.float64, count=len(forecasts)
+    )
+
     # Prepare output
     output = {
         'timestamp': datetime.now().isoformat(),
@@ -420,18 +545,12 @@ def main():
         'horizon': args.horizon,
         'forecasts': forecasts,
         'summary': {
-            'avgPredictedPxi': np.mean([f['predictedPxi'] for f in forecasts]),
-            'avgConfidence': np.mean([f['confidence'] for f in forecasts]),
-            'regimeDistribution': {}
+            'avgPredictedPxi': float(pxi_arr.mean()),
+            'avgConfidence': float(conf_arr.mean()),
+            'regimeDistribution': dict(Counter(f['predictedRegime'] for f in forecasts))
         }
     }
 
-    # Calculate regime distribution
-    for forecast in forecasts:
-        regime = forecast['predictedRegime']
-        output['summary']['regimeDistribution'][regime] = \
-            output['summary']['regimeDistribution'].get(regime, 0) + 1
-
     # Output JSON to stdout (TypeScript will parse this)
     print(json.dumps(output, indent=2))
 
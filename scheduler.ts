@@ -20,6 +20,9 @@
  * - Feature extraction from z-scores and rolling volatilities
  * - Automatic labeling as Calm/Normal/Stress
  *
+ * Refreshes the daily_pxi materialized view at 02:45 UTC:
+ * - Last PXI value per day, read by the LSTM predictor (ml/lstm_predictor.py)
+ *
  * Features:
  * - Robust error handling with retry logic
  * - Sequential execution (ingest → compute)
@@ -41,6 +44,7 @@ const execAsync = promisify(exec);
 // Scheduler configuration
 const CRON_SCHEDULE = '* * * * *'; // Every minute
 const VALIDATION_SCHEDULE = '0 2 * * *'; // 2 AM daily
+const DAILY_PXI_SCHEDULE = '45 2 * * *'; // 2:45 AM daily
 const MAX_RETRIES = 3;
 const RETRY_DELAY_MS = 5000; // 5 seconds
 const EXECUTION_TIMEOUT_MS = 55000; // 55 seconds (before next cron)
@@ -423,6 +427,23 @@ async function runRegimeDetection(): Promise<void> {
   }
 }
 
+/**
+ * Refresh the daily_pxi materialized view (LSTM training input)
+ */
+async function refreshDailyPxi(): Promise<void> {
+  const startTime = Date.now();
+
+  try {
+    await pool.query('SELECT refresh_daily_pxi()');
+    logger.info({ duration: Date.now() - startTime }, '✅ daily_pxi view refreshed');
+  } catch (error) {
+    logger.error(
+      { error: (error as Error).message, duration: Date.now() - startTime },
+      '❌ daily_pxi view refresh failed'
+    );
+  }
+}
+
 /**
  * Run BTC technical indicators calculation
  */
@@ -607,6 +628,14 @@ async function main() {
   regimeTask.start();
   logger.info({ schedule: '30 2 * * *' }, '✅ Daily regime detection scheduler started');
 
+  // Schedule daily_pxi view refresh (02:45 UTC)
+  const dailyPxiTask = cron.schedule(DAILY_PXI_SCHEDULE, async () => {
+    await refreshDailyPxi();
+  });
+
+  dailyPxiTask.start();
+  logger.info({ schedule: DAILY_PXI_SCHEDULE }, '✅ Daily PXI view refresh scheduler started');
+
   // Schedule BTC indicators twice daily (00:05 and 12:05 UTC)
   const indicatorsTask1 = cron.schedule('5 0 * * *', async () => {
     await runBTCIndicators();